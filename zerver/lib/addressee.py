@@ -1,14 +1,16 @@
-from typing import Iterable, List, Optional, Sequence, Union, cast
+from typing import Dict, Iterable, List, Optional, Sequence, Union, cast
 
 from django.utils.translation import gettext as _
 
 from zerver.lib.exceptions import JsonableError
+from zerver.lib.users import bulk_get_users_by_id
 from zerver.models import (
     Realm,
     Stream,
     UserProfile,
     get_user_by_id_in_realm_including_cross_realm,
     get_user_including_cross_realm,
+    is_user_in_realm_including_cross_realm,
 )
 
 
@@ -34,6 +36,19 @@ def get_user_profiles_by_ids(user_ids: Iterable[int], realm: Realm) -> List[User
     return user_profiles
 
 
+def bulk_get_user_profiles_by_ids(user_ids: Iterable[int], realm: Realm) -> Dict[int, UserProfile]:
+    """Like get_user_profiles_by_ids, but fetches the users in bulk and
+    returns them keyed by ID. Rather than raising an error, IDs that
+    don't belong to a user in the realm (or a cross-realm bot) are left
+    out, so that the caller can decide how to report them."""
+    user_profiles_by_id = bulk_get_users_by_id(list(user_ids))
+    return {
+        user_id: user_profile
+        for user_id, user_profile in user_profiles_by_id.items()
+        if is_user_in_realm_including_cross_realm(user_profile, realm)
+    }
+
+
 def validate_topic(topic: str) -> str:
     assert topic is not None
     topic = topic.strip()
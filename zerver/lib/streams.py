@@ -317,6 +317,23 @@ def access_stream_for_delete_or_update(
     return (stream, sub)
 
 
+def can_access_stream_without_subscription(user_profile: UserProfile, stream: Stream) -> bool:
+    """Whether the user can access a stream in their realm without being
+    subscribed to it. access_stream_common allows access to any other
+    stream only with a subscription (or, for some callers, to realm
+    administrators)."""
+
+    # Any realm user, even guests, can access web_public streams.
+    if stream.is_web_public:
+        return True
+
+    # If the stream is in your realm and public, you can access it.
+    if stream.is_public() and not user_profile.is_guest:
+        return True
+
+    return False
+
+
 # Only set allow_realm_admin flag to True when you want to allow realm admin to
 # access unsubscribed private stream content.
 def access_stream_common(
@@ -344,12 +361,9 @@ def access_stream_common(
     except Subscription.DoesNotExist:
         sub = None
 
-    # Any realm user, even guests, can access web_public streams.
-    if stream.is_web_public:
-        return sub
-
-    # If the stream is in your realm and public, you can access it.
-    if stream.is_public() and not user_profile.is_guest:
+    # Web-public streams, and public streams for non-guests, don't
+    # require a subscription.
+    if can_access_stream_without_subscription(user_profile, stream):
         return sub
 
     # Or if you are subscribed to the stream, you can access it.
@@ -203,20 +203,27 @@ def get_user_id(user: UserProfile) -> int:
     return user.id
 
 
-def user_ids_to_users(user_ids: Sequence[int], realm: Realm) -> List[UserProfile]:
-    # TODO: Consider adding a flag to control whether deactivated
-    # users should be included.
+def bulk_get_users_by_id(user_ids: Sequence[int]) -> Dict[int, UserProfile]:
+    """Fetches the users with the given IDs, in any realm, using the
+    user_profile_by_id cache. IDs that don't exist are left out."""
 
     def fetch_users_by_id(user_ids: List[int]) -> List[UserProfile]:
         return list(UserProfile.objects.filter(id__in=user_ids).select_related())
 
-    user_profiles_by_id: Dict[int, UserProfile] = bulk_cached_fetch(
+    return bulk_cached_fetch(
         cache_key_function=user_profile_by_id_cache_key,
         query_function=fetch_users_by_id,
         object_ids=user_ids,
         id_fetcher=get_user_id,
     )
 
+
+def user_ids_to_users(user_ids: Sequence[int], realm: Realm) -> List[UserProfile]:
+    # TODO: Consider adding a flag to control whether deactivated
+    # users should be included.
+
+    user_profiles_by_id = bulk_get_users_by_id(user_ids)
+
     found_user_ids = user_profiles_by_id.keys()
     missed_user_ids = [user_id for user_id in user_ids if user_id not in found_user_ids]
     if missed_user_ids:
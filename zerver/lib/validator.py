@@ -147,6 +147,14 @@ def check_float(var_name: str, val: object) -> float:
     return val
 
 
+def check_number(var_name: str, val: object) -> float:
+    """Accepts an integer or a float (but not a boolean), which saves
+    going through check_union([check_int, check_float])."""
+    if not isinstance(val, (int, float)) or isinstance(val, bool):
+        raise ValidationError(_("{var_name} is not a number").format(var_name=var_name))
+    return val
+
+
 def check_bool(var_name: str, val: object) -> bool:
     if not isinstance(val, bool):
         raise ValidationError(_("{var_name} is not a boolean").format(var_name=var_name))
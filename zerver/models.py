@@ -2891,17 +2891,24 @@ def get_system_bot(email: str) -> UserProfile:
     return UserProfile.objects.select_related().get(email__iexact=email.strip())
 
 
-def get_user_by_id_in_realm_including_cross_realm(
-    uid: int,
+def is_user_in_realm_including_cross_realm(
+    user_profile: UserProfile,
     realm: Optional[Realm],
-) -> UserProfile:
-    user_profile = get_user_profile_by_id(uid)
+) -> bool:
     if user_profile.realm == realm:
-        return user_profile
+        return True
 
     # Note: This doesn't validate whether the `realm` passed in is
     # None/invalid for the CROSS_REALM_BOT_EMAILS case.
-    if user_profile.delivery_email in settings.CROSS_REALM_BOT_EMAILS:
+    return user_profile.delivery_email in settings.CROSS_REALM_BOT_EMAILS
+
+
+def get_user_by_id_in_realm_including_cross_realm(
+    uid: int,
+    realm: Optional[Realm],
+) -> UserProfile:
+    user_profile = get_user_profile_by_id(uid)
+    if is_user_in_realm_including_cross_realm(user_profile, realm):
         return user_profile
 
     raise UserProfile.DoesNotExist()
@@ -68,6 +68,7 @@ from zerver.lib.validator import (
     check_int_in,
     check_list,
     check_none_or,
+    check_number,
     check_short_string,
     check_string,
     check_string_fixed_length,
@@ -814,6 +815,21 @@ class ValidatorTestCase(ZulipTestCase):
         with self.assertRaisesRegex(ValidationError, r"x is not a float"):
             check_float("x", x)
 
+    def test_check_number(self) -> None:
+        x: Any = 5.5
+        check_number("x", x)
+
+        x = 5
+        check_number("x", x)
+
+        x = True
+        with self.assertRaisesRegex(ValidationError, r"x is not a number"):
+            check_number("x", x)
+
+        x = "5"
+        with self.assertRaisesRegex(ValidationError, r"x is not a number"):
+            check_number("x", x)
+
     def test_check_color(self) -> None:
         x = ["#000099", "#80ffaa", "#80FFAA", "#abcd12", "#ffff00", "#ff0", "#f00"]  # valid
         y = ["000099", "#80f_aa", "#80fraa", "#abcd1234", "blue"]  # invalid
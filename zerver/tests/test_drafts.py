@@ -1,33 +1,42 @@
 import time
 from copy import deepcopy
 from typing import Any, Dict, List, Optional
+from unittest import mock
 
 import orjson
 
+from zerver.lib.actions import do_create_user, recipient_for_user_profiles
 from zerver.lib.test_classes import ZulipTestCase
-from zerver.models import Draft
+from zerver.lib.test_helpers import queries_captured
+from zerver.models import MAX_TOPIC_NAME_LENGTH, Draft, Huddle, Recipient, get_huddle_hash
+from zerver.views.drafts import bulk_insert_drafts, further_validated_draft_dict
 
 
 class DraftCreationTests(ZulipTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.hamlet = self.example_user("hamlet")
+
+    def get_visible_stream_id(self) -> int:
+        return self.get_stream_id(self.get_streams(self.hamlet)[0])
+
     def create_and_check_drafts_for_success(
         self,
         draft_dicts: List[Dict[str, Any]],
         expected_draft_dicts: Optional[List[Dict[str, Any]]] = None,
     ) -> None:
-        hamlet = self.example_user("hamlet")
-
         # Make sure that there are no drafts in the database before
         # the test begins.
         self.assertEqual(Draft.objects.count(), 0)
 
         # Now send a POST request to the API endpoint.
         payload = {"drafts": orjson.dumps(draft_dicts).decode()}
-        resp = self.api_post(hamlet, "/api/v1/drafts", payload)
+        resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
         self.assert_json_success(resp)
 
         # Finally check to make sure that the drafts were actually created properly.
         new_draft_dicts = []
-        for draft in Draft.objects.order_by("last_edit_time"):
+        for draft in Draft.objects.select_related("recipient").order_by("last_edit_time"):
             draft_dict = draft.to_dict()
             draft_dict.pop("id")
             new_draft_dicts.append(draft_dict)
@@ -38,15 +47,13 @@ class DraftCreationTests(ZulipTestCase):
     def create_and_check_drafts_for_error(
         self, draft_dicts: List[Dict[str, Any]], expected_message: str
     ) -> None:
-        hamlet = self.example_user("hamlet")
-
         # Make sure that there are no drafts in the database before
         # the test begins.
         self.assertEqual(Draft.objects.count(), 0)
 
         # Now send a POST request to the API endpoint.
         payload = {"drafts": orjson.dumps(draft_dicts).decode()}
-        resp = self.api_post(hamlet, "/api/v1/drafts", payload)
+        resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
         self.assert_json_error(resp, expected_message)
 
         # Make sure that there are no drafts in the database at the
@@ -55,9 +62,7 @@ class DraftCreationTests(ZulipTestCase):
         self.assertEqual(Draft.objects.count(), 0)
 
     def test_create_one_stream_draft_properly(self) -> None:
-        hamlet = self.example_user("hamlet")
-        visible_stream_name = self.get_streams(hamlet)[0]
-        visible_stream_id = self.get_stream_id(visible_stream_name)
+        visible_stream_id = self.get_visible_stream_id()
         draft_dicts = [
             {
                 "type": "stream",
@@ -115,9 +120,7 @@ class DraftCreationTests(ZulipTestCase):
         self.create_and_check_drafts_for_success(draft_dicts, expected_draft_dicts)
 
     def test_create_batch_of_drafts_properly(self) -> None:
-        hamlet = self.example_user("hamlet")
-        visible_stream_name = self.get_streams(hamlet)[0]
-        visible_stream_id = self.get_stream_id(visible_stream_name)
+        visible_stream_id = self.get_visible_stream_id()
         zoe = self.example_user("ZOE")
         othello = self.example_user("othello")
         draft_dicts = [
@@ -145,13 +148,213 @@ class DraftCreationTests(ZulipTestCase):
         ]
         self.create_and_check_drafts_for_success(draft_dicts)
 
+    def test_create_drafts_for_same_private_recipients(self) -> None:
+        zoe = self.example_user("ZOE")
+        othello = self.example_user("othello")
+        draft_dicts = [
+            {
+                "type": "private",
+                "to": [zoe.id, othello.id],
+                "topic": "",
+                "content": "What if we made it possible to sync drafts in Zulip?",
+                "timestamp": 1595479020,
+            },
+            {
+                "type": "private",
+                "to": [othello.id, zoe.id],
+                "topic": "",
+                "content": "We could also sync them across devices.",
+                "timestamp": 1595479021,
+            },
+        ]
+        payload = {"drafts": orjson.dumps(draft_dicts).decode()}
+        with mock.patch(
+            "zerver.views.drafts.recipient_for_user_profiles", wraps=recipient_for_user_profiles
+        ) as mock_recipient_for_user_profiles:
+            resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
+        self.assert_json_success(resp)
+        # The recipient is only resolved once for both drafts.
+        mock_recipient_for_user_profiles.assert_called_once()
+
+        recipient_ids = set(Draft.objects.values_list("recipient_id", flat=True))
+        self.assertEqual(len(recipient_ids), 1)
+
+    def test_create_batch_of_drafts_query_count(self) -> None:
+        """The number of queries needed to create a batch of drafts shouldn't
+        depend on how many drafts there are."""
+        zoe = self.example_user("ZOE")
+        othello = self.example_user("othello")
+        stream_ids = [self.make_stream(f"drafts stream {i}").id for i in range(3)]
+
+        def draft_dicts_for_streams(stream_ids: List[int]) -> List[Dict[str, Any]]:
+            draft_dicts: List[Dict[str, Any]] = []
+            for stream_id in stream_ids:
+                draft_dicts.append(
+                    {
+                        "type": "stream",
+                        "to": [stream_id],
+                        "topic": "sync drafts",
+                        "content": "Let's add backend support for syncing drafts.",
+                        "timestamp": 1595479019,
+                    }
+                )
+                draft_dicts.append(
+                    {
+                        "type": "private",
+                        "to": [zoe.id, othello.id],
+                        "topic": "",
+                        "content": "What if we made it possible to sync drafts in Zulip?",
+                        "timestamp": 1595479019,
+                    }
+                )
+            return draft_dicts
+
+        small_payload = {"drafts": orjson.dumps(draft_dicts_for_streams(stream_ids[:1])).decode()}
+        large_payload = {"drafts": orjson.dumps(draft_dicts_for_streams(stream_ids)).decode()}
+
+        # Make sure the huddle recipient already exists, so that neither
+        # of the requests we measure needs to create it.
+        resp = self.api_post(self.hamlet, "/api/v1/drafts", large_payload)
+        self.assert_json_success(resp)
+
+        with queries_captured() as small_batch_queries:
+            resp = self.api_post(self.hamlet, "/api/v1/drafts", small_payload)
+        self.assert_json_success(resp)
+
+        with queries_captured() as large_batch_queries:
+            resp = self.api_post(self.hamlet, "/api/v1/drafts", large_payload)
+        self.assert_json_success(resp)
+
+        self.assert_length(large_batch_queries, len(small_batch_queries))
+
+    def test_create_stream_drafts_subscription_query(self) -> None:
+        """Only drafts for streams that require a subscription need to query
+        the user's subscriptions."""
+        public_stream = self.make_stream("drafts public stream")
+        private_stream = self.make_stream("drafts private stream", invite_only=True)
+        self.subscribe(self.hamlet, private_stream.name)
+
+        def payload_for_stream(stream_id: int) -> Dict[str, str]:
+            draft_dicts = [
+                {
+                    "type": "stream",
+                    "to": [stream_id],
+                    "topic": "sync drafts",
+                    "content": "Let's add backend support for syncing drafts.",
+                    "timestamp": 1595479019,
+                }
+            ]
+            return {"drafts": orjson.dumps(draft_dicts).decode()}
+
+        with queries_captured() as public_stream_queries:
+            resp = self.api_post(
+                self.hamlet, "/api/v1/drafts", payload_for_stream(public_stream.id)
+            )
+        self.assert_json_success(resp)
+
+        with queries_captured() as private_stream_queries:
+            resp = self.api_post(
+                self.hamlet, "/api/v1/drafts", payload_for_stream(private_stream.id)
+            )
+        self.assert_json_success(resp)
+
+        self.assert_length(private_stream_queries, len(public_stream_queries) + 1)
+
+    def test_create_stream_draft_for_unsubscribed_zephyr_stream(self) -> None:
+        # Streams in Zephyr mirroring realms are private even when they
+        # aren't invite-only, so drafts need a subscription to them.
+        user = self.mit_user("starnine")
+        stream = self.make_stream("drafts zephyr stream", realm=user.realm)
+        draft_dicts = [
+            {
+                "type": "stream",
+                "to": [stream.id],
+                "topic": "sync drafts",
+                "content": "Let's add backend support for syncing drafts.",
+                "timestamp": 1595479019,
+            }
+        ]
+        payload = {"drafts": orjson.dumps(draft_dicts).decode()}
+        resp = self.api_post(user, "/api/v1/drafts", payload, subdomain="zephyr")
+        self.assert_json_error(resp, "Invalid stream id")
+        self.assertEqual(Draft.objects.count(), 0)
+
+        self.subscribe(user, stream.name)
+        resp = self.api_post(user, "/api/v1/drafts", payload, subdomain="zephyr")
+        self.assert_json_success(resp)
+        self.assertEqual(Draft.objects.count(), 1)
+
+    def test_create_duplicate_drafts(self) -> None:
+        """Identical drafts in a batch are each created, with their own IDs,
+        but only validated once."""
+        visible_stream_id = self.get_visible_stream_id()
+        draft_dict = {
+            "type": "stream",
+            "to": [visible_stream_id],
+            "topic": "sync drafts",
+            "content": "Let's add backend support for syncing drafts.",
+            "timestamp": 1595479019,
+        }
+        payload = {"drafts": orjson.dumps([draft_dict, draft_dict]).decode()}
+        with mock.patch(
+            "zerver.views.drafts.further_validated_draft_dict", wraps=further_validated_draft_dict
+        ) as mock_further_validated_draft_dict:
+            resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
+        self.assert_json_success(resp)
+        mock_further_validated_draft_dict.assert_called_once()
+
+        draft_ids = orjson.loads(resp.content)["ids"]
+        self.assertEqual(len(set(draft_ids)), 2)
+        self.assertEqual(Draft.objects.count(), 2)
+
+    def test_create_large_batch_of_drafts(self) -> None:
+        """Large batches are inserted with raw SQL rather than through the ORM."""
+        visible_stream_id = self.get_visible_stream_id()
+        zoe = self.example_user("ZOE")
+        draft_dicts = []
+        for i in range(60):
+            draft_dicts.append(
+                {
+                    "type": "stream",
+                    "to": [visible_stream_id],
+                    "topic": f"sync drafts {i}",
+                    "content": f"Draft number {i}.",
+                    "timestamp": 1595479019 + i,
+                }
+            )
+        draft_dicts.append(
+            {
+                "type": "private",
+                "to": [zoe.id],
+                "topic": "",
+                "content": "What if we made it possible to sync drafts in Zulip?",
+                "timestamp": 1595479100,
+            }
+        )
+        self.assertEqual(Draft.objects.count(), 0)
+
+        payload = {"drafts": orjson.dumps(draft_dicts).decode()}
+        with mock.patch(
+            "zerver.views.drafts.bulk_insert_drafts", wraps=bulk_insert_drafts
+        ) as mock_bulk_insert_drafts:
+            resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
+        self.assert_json_success(resp)
+        mock_bulk_insert_drafts.assert_called_once()
+
+        # The IDs we return should be in the same order as the drafts.
+        draft_ids = orjson.loads(resp.content)["ids"]
+        drafts_by_id = Draft.objects.select_related("recipient").in_bulk(draft_ids)
+        new_draft_dicts = []
+        for draft_id in draft_ids:
+            draft_dict = drafts_by_id[draft_id].to_dict()
+            draft_dict.pop("id")
+            new_draft_dicts.append(draft_dict)
+        self.assertEqual(new_draft_dicts, draft_dicts)
+
     def test_missing_timestamps(self) -> None:
         """If a timestamp is not provided for a draft dict then it should be automatically
         filled in."""
-        hamlet = self.example_user("hamlet")
-        visible_stream_name = self.get_streams(hamlet)[0]
-        visible_stream_id = self.get_stream_id(visible_stream_name)
-
+        visible_stream_id = self.get_visible_stream_id()
         draft_dicts = [
             {
                 "type": "stream",
@@ -165,7 +368,7 @@ class DraftCreationTests(ZulipTestCase):
 
         current_time = int(time.time())
         payload = {"drafts": orjson.dumps(draft_dicts).decode()}
-        resp = self.api_post(hamlet, "/api/v1/drafts", payload)
+        resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
         self.assert_json_success(resp)
 
         new_drafts = Draft.objects.all()
@@ -176,6 +379,31 @@ class DraftCreationTests(ZulipTestCase):
         # a relative check.
         self.assertTrue(new_draft["timestamp"] >= current_time)
 
+    def test_missing_timestamps_in_batch(self) -> None:
+        """All the drafts in a batch that are missing a timestamp should be
+        given the same one."""
+        draft_dicts = [
+            {
+                "type": "",
+                "to": [],
+                "topic": "",
+                "content": "The first draft.",
+            },
+            {
+                "type": "",
+                "to": [],
+                "topic": "",
+                "content": "The second draft.",
+            },
+        ]
+
+        payload = {"drafts": orjson.dumps(draft_dicts).decode()}
+        resp = self.api_post(self.hamlet, "/api/v1/drafts", payload)
+        self.assert_json_success(resp)
+
+        last_edit_times = set(Draft.objects.values_list("last_edit_time", flat=True))
+        self.assertEqual(len(last_edit_times), 1)
+
     def test_invalid_timestamp(self) -> None:
         draft_dicts = [
             {
@@ -224,6 +452,41 @@ class DraftCreationTests(ZulipTestCase):
         ]
         self.create_and_check_drafts_for_success(draft_dicts, expected_draft_dicts)
 
+    def test_create_batch_of_drafts_is_atomic(self) -> None:
+        """If any draft in a batch is invalid, nothing should be left behind
+        by the drafts before it, including newly created huddles."""
+        zoe = self.example_user("ZOE")
+        new_user = do_create_user(
+            "drafts-user@zulip.com", None, self.hamlet.realm, "Drafts User", acting_user=None
+        )
+        huddle_user_ids = [self.hamlet.id, zoe.id, new_user.id]
+        huddle_count = Huddle.objects.count()
+        recipient_count = Recipient.objects.count()
+
+        draft_dicts = [
+            {
+                "type": "private",
+                "to": [zoe.id, new_user.id],
+                "topic": "",
+                "content": "What if we made it possible to sync drafts in Zulip?",
+                "timestamp": 1595479019,
+            },
+            {
+                "type": "stream",
+                "to": [99999999999999],
+                "topic": "sync drafts",
+                "content": "Let's add backend support for syncing drafts.",
+                "timestamp": 1595479019,
+            },
+        ]
+        self.create_and_check_drafts_for_error(draft_dicts, "Invalid stream id")
+
+        self.assertFalse(
+            Huddle.objects.filter(huddle_hash=get_huddle_hash(huddle_user_ids)).exists()
+        )
+        self.assertEqual(Huddle.objects.count(), huddle_count)
+        self.assertEqual(Recipient.objects.count(), recipient_count)
+
     def test_create_stream_draft_with_no_recipient(self) -> None:
         draft_dicts = [
             {
@@ -299,6 +562,43 @@ class DraftCreationTests(ZulipTestCase):
         ]
         self.create_and_check_drafts_for_error(draft_dicts, "Topic must not contain null bytes")
 
+        # A null byte past the point where the topic is truncated is
+        # dropped with the rest of the topic, so it's allowed.
+        visible_stream_id = self.get_visible_stream_id()
+        draft_dicts = [
+            {
+                "type": "stream",
+                "to": [visible_stream_id],
+                "topic": "a" * MAX_TOPIC_NAME_LENGTH + "\x00",
+                "content": "Let's add backend support for syncing drafts.",
+                "timestamp": 1595479019,
+            }
+        ]
+        expected_draft_dicts = deepcopy(draft_dicts)
+        expected_draft_dicts[0]["topic"] = "a" * (MAX_TOPIC_NAME_LENGTH - 3) + "..."
+        self.create_and_check_drafts_for_success(draft_dicts, expected_draft_dicts)
+        Draft.objects.all().delete()
+
+        # Null bytes anywhere in a batch are reported before any other
+        # problems with the drafts, like an inaccessible stream.
+        draft_dicts = [
+            {
+                "type": "stream",
+                "to": [99999999999999],
+                "topic": "sync drafts",
+                "content": "Let's add backend support for syncing drafts.",
+                "timestamp": 15954790199,
+            },
+            {
+                "type": "",
+                "to": [],
+                "topic": "",
+                "content": "Some regular \x00 content here",
+                "timestamp": 15954790199,
+            },
+        ]
+        self.create_and_check_drafts_for_error(draft_dicts, "Message must not contain null bytes")
+
 
 class DraftEditTests(ZulipTestCase):
     def test_edit_draft_successfully(self) -> None:
@@ -1,32 +1,38 @@
 import time
-from typing import Any, Dict, List, Set
+from typing import Any, Dict, FrozenSet, List, Set, Tuple
 
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 from django.http import HttpRequest, HttpResponse
 from django.utils.translation import gettext as _
+from psycopg2.extras import execute_values
+from psycopg2.sql import SQL
 
 from zerver.lib.actions import recipient_for_user_profiles
-from zerver.lib.addressee import get_user_profiles_by_ids
+from zerver.lib.addressee import bulk_get_user_profiles_by_ids
 from zerver.lib.exceptions import JsonableError
 from zerver.lib.message import normalize_body, truncate_topic
 from zerver.lib.request import REQ, has_request_variables
 from zerver.lib.response import json_error, json_success
-from zerver.lib.streams import access_stream_by_id
+from zerver.lib.streams import can_access_stream_without_subscription
 from zerver.lib.timestamp import timestamp_to_datetime
 from zerver.lib.validator import (
     check_dict_only,
-    check_float,
     check_int,
     check_list,
+    check_number,
     check_required_string,
     check_string,
     check_string_in,
-    check_union,
 )
-from zerver.models import Draft, UserProfile
+from zerver.models import Draft, Recipient, Stream, Subscription, UserProfile
 
 VALID_DRAFT_TYPES: Set[str] = {"", "private", "stream"}
 
+# Batches of at least this many drafts are inserted with raw SQL rather
+# than through Draft.objects.bulk_create; see bulk_insert_drafts.
+BULK_INSERT_DRAFTS_THRESHOLD = 50
+
 # A validator to verify if the structure (syntax) of a dictionary
 # meets the requirements to be a draft dictionary:
 draft_dict_validator = check_dict_only(
@@ -37,22 +43,102 @@ draft_dict_validator = check_dict_only(
         ("content", check_required_string),
     ],
     optional_keys=[
-        ("timestamp", check_union([check_int, check_float])),  # A Unix timestamp.
+        ("timestamp", check_number),  # A Unix timestamp.
     ],
 )
 
 
+def check_draft_dicts_for_null_bytes(draft_dicts: List[Dict[str, Any]]) -> None:
+    """Reject a batch of drafts if any of them contains null bytes. This is
+    done before fetching anything from the database so that such a batch
+    fails without doing any other work."""
+    for draft_dict in draft_dicts:
+        if "\x00" in draft_dict["content"]:
+            raise JsonableError(_("Message must not contain null bytes"))
+        # The topic is ignored for anything other than stream messages, and
+        # anything past the truncation point is dropped, so isn't checked.
+        if draft_dict["type"] == "stream" and "\x00" in truncate_topic(draft_dict["topic"]):
+            raise JsonableError(_("Topic must not contain null bytes"))
+
+
+def prefetch_draft_recipients(
+    draft_dicts: List[Dict[str, Any]], user_profile: UserProfile
+) -> Tuple[Dict[int, Stream], Dict[int, UserProfile]]:
+    """Fetch, in bulk, the streams and users that a batch of draft dicts
+    refer to, so that validating each draft doesn't need its own queries.
+
+    Returns a dictionary of the streams the user can access and a dictionary
+    of the users the drafts can be addressed to, both keyed by ID. Anything
+    that doesn't exist or that the user can't access is simply left out;
+    further_validated_draft_dict raises the appropriate error when it finds
+    an ID that's missing from these."""
+
+    stream_ids: Set[int] = set()
+    user_ids: Set[int] = set()
+    for draft_dict in draft_dicts:
+        to = draft_dict["to"]
+        if draft_dict["type"] == "stream" and len(to) == 1:
+            stream_ids.add(to[0])
+        elif draft_dict["type"] == "private":
+            user_ids.update(to)
+
+    accessible_streams: Dict[int, Stream] = {}
+    if stream_ids:
+        streams = list(
+            Stream.objects.filter(id__in=stream_ids, realm=user_profile.realm).select_related(
+                "realm", "recipient"
+            )
+        )
+        # These are the same rules as access_stream_common. Only streams
+        # that require a subscription need the Subscription query, which
+        # we skip entirely in the common case of public streams.
+        restricted_streams = []
+        for stream in streams:
+            if can_access_stream_without_subscription(user_profile, stream):
+                accessible_streams[stream.id] = stream
+            else:
+                restricted_streams.append(stream)
+        if restricted_streams:
+            subscribed_recipient_ids = set(
+                Subscription.objects.filter(
+                    user_profile=user_profile,
+                    recipient_id__in=[stream.recipient_id for stream in restricted_streams],
+                    active=True,
+                ).values_list("recipient_id", flat=True)
+            )
+            for stream in restricted_streams:
+                if stream.recipient_id in subscribed_recipient_ids:
+                    accessible_streams[stream.id] = stream
+
+    recipient_users = bulk_get_user_profiles_by_ids(user_ids, user_profile.realm)
+
+    return accessible_streams, recipient_users
+
+
 def further_validated_draft_dict(
-    draft_dict: Dict[str, Any], user_profile: UserProfile
+    draft_dict: Dict[str, Any],
+    user_profile: UserProfile,
+    accessible_streams: Dict[int, Stream],
+    recipient_users: Dict[int, UserProfile],
+    private_recipients: Dict[FrozenSet[int], Recipient],
+    now: float,
 ) -> Dict[str, Any]:
     """Take a draft_dict that was already validated by draft_dict_validator then
     further sanitize, validate, and transform it. Ultimately return this "further
     validated" draft dict. It will have a slightly different set of keys the values
-    for which can be used to directly create a Draft object."""
+    for which can be used to directly create a Draft object.
+
+    The streams and users that the draft may be addressed to must have been
+    fetched beforehand using prefetch_draft_recipients, and the draft must
+    have passed check_draft_dicts_for_null_bytes. private_recipients caches
+    the recipients for private drafts by their set of user IDs, so that
+    several drafts to the same users only resolve the recipient once; it
+    should be shared by all the drafts in a request. Drafts without a
+    timestamp are given `now`, which callers compute once per request."""
 
     content = normalize_body(draft_dict["content"])
 
-    timestamp = draft_dict.get("timestamp", time.time())
+    timestamp = draft_dict.get("timestamp", now)
     timestamp = round(timestamp, 6)
     if timestamp < 0:
         # While it's not exactly an invalid timestamp, it's not something
@@ -65,18 +151,26 @@ def further_validated_draft_dict(
     to = draft_dict["to"]
     if draft_dict["type"] == "stream":
         topic = truncate_topic(draft_dict["topic"])
-        if "\x00" in topic:
-            raise JsonableError(_("Topic must not contain null bytes"))
         if len(to) != 1:
             raise JsonableError(_("Must specify exactly 1 stream ID for stream messages"))
-        stream, sub = access_stream_by_id(user_profile, to[0])
-        recipient = stream.recipient
+        if to[0] not in accessible_streams:
+            raise JsonableError(_("Invalid stream id"))
+        recipient = accessible_streams[to[0]].recipient
     elif draft_dict["type"] == "private" and len(to) != 0:
-        to_users = get_user_profiles_by_ids(set(to), user_profile.realm)
-        try:
-            recipient = recipient_for_user_profiles(to_users, False, None, user_profile)
-        except ValidationError as e:  # nocoverage
-            raise JsonableError(e.messages[0])
+        to_user_ids = frozenset(to)
+        if to_user_ids in private_recipients:
+            recipient = private_recipients[to_user_ids]
+        else:
+            to_users = []
+            for user_id in to_user_ids:
+                if user_id not in recipient_users:
+                    raise JsonableError(_("Invalid user ID {}").format(user_id))
+                to_users.append(recipient_users[user_id])
+            try:
+                recipient = recipient_for_user_profiles(to_users, False, None, user_profile)
+            except ValidationError as e:  # nocoverage
+                raise JsonableError(e.messages[0])
+            private_recipients[to_user_ids] = recipient
 
     return {
         "recipient": recipient,
@@ -86,12 +180,50 @@ def further_validated_draft_dict(
     }
 
 
+def bulk_insert_drafts(
+    user_profile: UserProfile, valid_draft_dicts: List[Dict[str, Any]]
+) -> List[int]:
+    """
+    Like bulk_insert_ums, this inserts the drafts without constructing
+    Draft objects, which avoids the ORM overhead for large batches.
+    Returns the IDs of the new drafts, in the same order as
+    valid_draft_dicts.
+    """
+    vals = [
+        (
+            user_profile.id,
+            valid_draft_dict["recipient"].id if valid_draft_dict["recipient"] else None,
+            valid_draft_dict["topic"],
+            valid_draft_dict["content"],
+            valid_draft_dict["last_edit_time"],
+        )
+        for valid_draft_dict in valid_draft_dicts
+    ]
+    query = SQL(
+        """
+        INSERT into
+            zerver_draft (user_profile_id, recipient_id, topic, content, last_edit_time)
+        VALUES %s
+        RETURNING id
+    """
+    )
+
+    with connection.cursor() as cursor:
+        rows = execute_values(cursor.cursor, query, vals, page_size=1000, fetch=True)
+    return [row[0] for row in rows]
+
+
 def fetch_drafts(request: HttpRequest, user_profile: UserProfile) -> HttpResponse:
-    user_drafts = Draft.objects.filter(user_profile=user_profile).order_by("last_edit_time")
+    user_drafts = (
+        Draft.objects.filter(user_profile=user_profile)
+        .select_related("recipient")
+        .order_by("last_edit_time")
+    )
     draft_dicts = [draft.to_dict() for draft in user_drafts]
     return json_success({"count": user_drafts.count(), "drafts": draft_dicts})
 
 
+@transaction.atomic
 @has_request_variables
 def create_drafts(
     request: HttpRequest,
@@ -100,10 +232,40 @@ def create_drafts(
         "drafts", json_validator=check_list(draft_dict_validator)
     ),
 ) -> HttpResponse:
-    draft_objects = []
+    check_draft_dicts_for_null_bytes(draft_dicts)
+    accessible_streams, recipient_users = prefetch_draft_recipients(draft_dicts, user_profile)
+
+    private_recipients: Dict[FrozenSet[int], Recipient] = {}
+    now = time.time()
+    # Clients syncing drafts may submit identical drafts in one batch. Each
+    # copy still gets its own Draft, so that the IDs we return line up with
+    # the submitted drafts, but we only validate identical drafts once.
+    valid_draft_dicts_by_key: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    valid_draft_dicts = []
     for draft_dict in draft_dicts:
-        valid_draft_dict = further_validated_draft_dict(draft_dict, user_profile)
-        draft_objects.append(
+        key = (
+            draft_dict["type"],
+            tuple(draft_dict["to"]),
+            draft_dict["topic"],
+            draft_dict["content"],
+            draft_dict.get("timestamp"),
+        )
+        if key not in valid_draft_dicts_by_key:
+            valid_draft_dicts_by_key[key] = further_validated_draft_dict(
+                draft_dict,
+                user_profile,
+                accessible_streams,
+                recipient_users,
+                private_recipients,
+                now,
+            )
+        valid_draft_dicts.append(valid_draft_dicts_by_key[key])
+
+    if len(valid_draft_dicts) >= BULK_INSERT_DRAFTS_THRESHOLD:
+        draft_ids = bulk_insert_drafts(user_profile, valid_draft_dicts)
+    else:
+        # Batches this small don't need bulk_create's batch_size.
+        draft_objects = [
             Draft(
                 user_profile=user_profile,
                 recipient=valid_draft_dict["recipient"],
@@ -111,10 +273,10 @@ def create_drafts(
                 content=valid_draft_dict["content"],
                 last_edit_time=valid_draft_dict["last_edit_time"],
             )
-        )
-
-    created_draft_objects = Draft.objects.bulk_create(draft_objects)
-    draft_ids = [draft_object.id for draft_object in created_draft_objects]
+            for valid_draft_dict in valid_draft_dicts
+        ]
+        created_draft_objects = Draft.objects.bulk_create(draft_objects)
+        draft_ids = [draft_object.id for draft_object in created_draft_objects]
     return json_success({"ids": draft_ids})
 
 
@@ -130,7 +292,11 @@ def edit_draft(
     except Draft.DoesNotExist:
         return json_error(_("Draft does not exist"), status=404)
 
-    valid_draft_dict = further_validated_draft_dict(draft_dict, user_profile)
+    check_draft_dicts_for_null_bytes([draft_dict])
+    accessible_streams, recipient_users = prefetch_draft_recipients([draft_dict], user_profile)
+    valid_draft_dict = further_validated_draft_dict(
+        draft_dict, user_profile, accessible_streams, recipient_users, {}, time.time()
+    )
     draft_object.content = valid_draft_dict["content"]
     draft_object.topic = valid_draft_dict["topic"]
     draft_object.recipient = valid_draft_dict["recipient"]